@@ -2,11 +2,17 @@ from __future__ import annotations
 
 import io
 import os
+import re
+import zipfile
 from datetime import datetime
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Iterable, Optional, Sequence
 
+import orjson
 from flask import (
     Flask,
+    Response,
+    g,
     jsonify,
     redirect,
     render_template,
@@ -15,51 +21,155 @@ from flask import (
     session,
     url_for,
 )
+from flask.json.provider import DefaultJSONProvider
 
 from db import (
+    UserExistsError,
     delete_device,
     delete_user,
     fetch_devices,
     fetch_users,
-    get_user,
     init_db,
     insert_device,
+    insert_user,
     set_makeup_hours,
-    upsert_user,
+    update_user_metadata,
 )
-from summary import get_daily_summary, summary_dataframe
-from zk_sync import SUPPORTED_MODELS, SyncError, sync_attendance, test_connection
 
 
 REQUIRED_DEVICE_KEYS = {"host", "port", "timeout", "password", "force_udp"}
-TRUE_VALUES = {"1", "true", "yes", "on"}
+# Common spellings are listed verbatim so they match without strip()/lower().
+TRUE_VALUES = frozenset({"1", "true", "yes", "on", "True", "TRUE", "Yes", "YES", "On", "ON"})
+
+EXPORT_HEADER = ("Employee ID", "Name", "Date", "Check In", "Check Out", "Working Hours")
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    "</Types>"
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+    "</workbook>"
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    "</Relationships>"
+)
+XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    "</styleSheet>"
+)
+XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_TAIL = "</sheetData></worksheet>"
+XML_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+XML_INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serialises with orjson."""
+
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = ORJSON_OPTIONS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
+def _orjson_response(data: Any) -> Response:
+    """Serialise straight to bytes for large payloads, skipping the str round trip."""
+    return Response(
+        orjson.dumps(data, default=DefaultJSONProvider.default, option=ORJSON_OPTIONS),
+        mimetype="application/json",
+    )
 
 
 def _parse_bool(value: Optional[object]) -> bool:
-    if isinstance(value, bool):
-        return value
-    if value is None:
+    if value is True:
+        return True
+    if value is False or value is None:
         return False
     if isinstance(value, str):
-        return value.strip().lower() in TRUE_VALUES
+        return value in TRUE_VALUES or value.strip().lower() in TRUE_VALUES
     return bool(value)
 
 
-def _get_session_device_config() -> Optional[dict]:
-    config = session.get("device_config")
-    if not isinstance(config, dict):
+def _parse_device_config(raw_config: object) -> Optional[dict]:
+    if not isinstance(raw_config, dict):
         return None
-    if not REQUIRED_DEVICE_KEYS.issubset(config.keys()):
+    if not REQUIRED_DEVICE_KEYS.issubset(raw_config.keys()):
         return None
-    if not config.get("host"):
+    if not raw_config.get("host"):
         return None
     try:
-        config["port"] = int(config["port"])
-        config["timeout"] = int(config["timeout"])
-        config["password"] = int(config["password"])
-        config["force_udp"] = _parse_bool(config["force_udp"])
+        return {
+            **raw_config,
+            "port": int(raw_config["port"]),
+            "timeout": int(raw_config["timeout"]),
+            "password": int(raw_config["password"]),
+            "force_udp": _parse_bool(raw_config["force_udp"]),
+        }
     except (TypeError, ValueError):
         return None
+
+
+def _get_session_device_config() -> Optional[dict]:
+    """Return the validated session device config, parsed at most once per request."""
+    if "device_config" in g:
+        return g.device_config
+    raw_config = session.get("device_config")
+    config = _parse_device_config(raw_config)
+    if config is not None and config != raw_config:
+        # Persist the normalised values so later requests compare equal.
+        session["device_config"] = config
+    g.device_config = config
     return config
 
 
@@ -70,9 +180,76 @@ def _ensure_device_connection():
     return config, None
 
 
+def _format_time_cell(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    # Stored timestamps are ISO formatted, so the time is a fixed slice.
+    if len(value) >= 19 and value[10] in "T " and value[13] == ":" and value[16] == ":":
+        return value[11:19]
+    return _format_time_fallback(value)
+
+
+@lru_cache(maxsize=4096)
+def _format_time_fallback(value: str) -> str:
+    try:
+        return datetime.fromisoformat(value).strftime("%H:%M:%S")
+    except ValueError:
+        return value
+
+
+def _xlsx_column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_cell(reference: str, value: object, style: int = 0) -> str:
+    if value is None or value == "":
+        return ""
+    style_attr = f' s="{style}"' if style else ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{reference}"{style_attr}><v>{value!r}</v></c>'
+    text = XML_INVALID_CHARS.sub("", str(value)).translate(XML_ESCAPES)
+    return f'<c r="{reference}"{style_attr} t="inlineStr"><is><t>{text}</t></is></c>'
+
+
+def _write_xlsx(buffer: io.BytesIO, header: Sequence[str], rows: Iterable[Sequence]) -> None:
+    """Write a single-sheet XLSX workbook by emitting the SpreadsheetML parts directly."""
+    letters = [_xlsx_column_letter(index) for index in range(len(header))]
+    sheet_rows = [
+        '<row r="1">'
+        + "".join(_xlsx_cell(f"{letter}1", value, style=1) for letter, value in zip(letters, header))
+        + "</row>"
+    ]
+    for row_number, row in enumerate(rows, start=2):
+        sheet_rows.append(
+            f'<row r="{row_number}">'
+            + "".join(
+                _xlsx_cell(f"{letter}{row_number}", value) for letter, value in zip(letters, row)
+            )
+            + "</row>"
+        )
+
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", XLSX_ROOT_RELS)
+        archive.writestr("xl/workbook.xml", XLSX_WORKBOOK)
+        archive.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+        archive.writestr("xl/styles.xml", XLSX_STYLES)
+        archive.writestr(
+            "xl/worksheets/sheet1.xml",
+            XLSX_SHEET_HEAD + "".join(sheet_rows) + XLSX_SHEET_TAIL,
+        )
+
+
+# summary (pandas) and zk_sync (device driver) are imported inside the routes that
+# need them so workers start without loading either.
 def create_app() -> Flask:
     app = Flask(__name__)
-    app.config["JSON_SORT_KEYS"] = False
+    app.json = ORJSONProvider(app)
     app.secret_key = os.environ.get("FLASK_SECRET_KEY", "maychamcong-secret-key")
 
     init_db()
@@ -82,12 +259,14 @@ def create_app() -> Flask:
         config, redirect_response = _ensure_device_connection()
         if redirect_response:
             return redirect_response
-        users = [dict(row) for row in fetch_users()]
+        users = fetch_users()
         return render_template("index.html", users=users, device_config=config)
 
     @app.get("/connect")
     def connect_device():
-        devices = [dict(row) for row in fetch_devices()]
+        from zk_sync import SUPPORTED_MODELS
+
+        devices = fetch_devices()
         current_config = _get_session_device_config()
         return render_template(
             "connect.html",
@@ -101,16 +280,18 @@ def create_app() -> Flask:
         _, redirect_response = _ensure_device_connection()
         if redirect_response:
             return redirect_response
-        users = [dict(row) for row in fetch_users()]
+        users = fetch_users()
         return render_template("employees.html", users=users)
 
     @app.get("/devices")
     def devices():
-        devices = [dict(row) for row in fetch_devices()]
+        devices = fetch_devices()
         return render_template("devices.html", devices=devices)
 
     @app.get("/sync")
     def sync():
+        from zk_sync import SyncError, sync_attendance
+
         config = _get_session_device_config()
         if not config:
             return (
@@ -131,64 +312,49 @@ def create_app() -> Flask:
 
     @app.get("/summary")
     def summary():
+        from summary import get_daily_summary
+
         start_date = request.args.get("start_date")
         end_date = request.args.get("end_date")
         user_id = request.args.get("user_id", type=int)
         data = get_daily_summary(user_id=user_id, start_date=start_date, end_date=end_date)
-        return jsonify(data)
+        return _orjson_response(data)
 
     @app.get("/summary/<int:user_id>")
     def summary_by_user(user_id: int):
+        from summary import get_daily_summary
+
         start_date = request.args.get("start_date")
         end_date = request.args.get("end_date")
         data = get_daily_summary(user_id=user_id, start_date=start_date, end_date=end_date)
-        return jsonify(data)
+        return _orjson_response(data)
 
     @app.get("/export")
     def export():
+        from summary import get_daily_summary
+
+        _format_time_fallback.cache_clear()
         start_date = request.args.get("start_date")
         end_date = request.args.get("end_date")
         user_id = request.args.get("user_id", type=int)
-        df = summary_dataframe(user_id=user_id, start_date=start_date, end_date=end_date)
-        if df.empty:
+        rows = get_daily_summary(user_id=user_id, start_date=start_date, end_date=end_date)
+        if not rows:
             return jsonify({"status": "error", "message": "No data to export"}), 404
 
-        export_df = df[[
-            "user_id",
-            "name",
-            "date",
-            "check_in",
-            "check_out",
-            "working_hours",
-        ]].copy()
-        export_df.rename(
-            columns={
-                "user_id": "Employee ID",
-                "name": "Name",
-                "date": "Date",
-                "check_in": "Check In",
-                "check_out": "Check Out",
-                "working_hours": "Working Hours",
-            },
-            inplace=True,
-        )
-
-        def _format_time_cell(value: Optional[str]) -> str:
-            if not value:
-                return ""
-            try:
-                return datetime.fromisoformat(value).strftime("%H:%M:%S")
-            except ValueError:
-                return value
-
-        export_df["Check In"] = export_df["Check In"].map(_format_time_cell)
-        export_df["Check Out"] = export_df["Check Out"].map(_format_time_cell)
-        export_df["Working Hours"] = export_df["Working Hours"].map(
-            lambda x: "" if x is None or (isinstance(x, float) and (x != x)) else x
+        export_rows = (
+            (
+                row["user_id"],
+                row["name"],
+                row["date"],
+                _format_time_cell(row["check_in"]),
+                _format_time_cell(row["check_out"]),
+                row["working_hours"],
+            )
+            for row in rows
         )
 
         buffer = io.BytesIO()
-        export_df.to_excel(buffer, index=False)
+        _write_xlsx(buffer, EXPORT_HEADER, export_rows)
         buffer.seek(0)
         return send_file(
             buffer,
@@ -199,6 +365,8 @@ def create_app() -> Flask:
 
     @app.post("/makeup")
     def makeup():
+        from summary import get_daily_summary
+
         payload = request.get_json(silent=True) or {}
         try:
             user_id = int(payload.get("user_id"))
@@ -214,7 +382,8 @@ def create_app() -> Flask:
         if hours < 0:
             return jsonify({"status": "error", "message": "Hours must be non-negative"}), 400
 
-        set_makeup_hours(user_id=user_id, date=date_value, hours=hours, note=note)
+        if not set_makeup_hours(user_id=user_id, date=date_value, hours=hours, note=note):
+            return jsonify({"status": "error", "message": "User not found."}), 404
         summary_row = get_daily_summary(
             user_id=user_id,
             start_date=date_value,
@@ -236,35 +405,30 @@ def create_app() -> Flask:
         except (TypeError, ValueError):
             return jsonify({"status": "error", "message": "user_id must be a number."}), 400
 
-        if get_user(user_id):
-            return jsonify({"status": "error", "message": "User already exists."}), 409
-
         name = payload.get("name") or None
         department = payload.get("department") or None
 
-        upsert_user(user_id, name=name, department=department)
-        user_row = get_user(user_id)
+        try:
+            user_row = insert_user(user_id, name=name, department=department)
+        except UserExistsError:
+            return jsonify({"status": "error", "message": "User already exists."}), 409
         return jsonify({"status": "ok", "data": dict(user_row)}), 201
 
     @app.put("/api/users/<int:user_id>")
     def update_user(user_id: int):
-        if not get_user(user_id):
-            return jsonify({"status": "error", "message": "User not found."}), 404
-
         payload = request.get_json(silent=True) or {}
         name = payload.get("name")
         department = payload.get("department")
 
-        upsert_user(user_id, name=name, department=department)
-        user_row = get_user(user_id)
+        user_row = update_user_metadata(user_id, name=name, department=department)
+        if user_row is None:
+            return jsonify({"status": "error", "message": "User not found."}), 404
         return jsonify({"status": "ok", "data": dict(user_row)})
 
     @app.delete("/api/users/<int:user_id>")
     def remove_user(user_id: int):
-        if not get_user(user_id):
+        if not delete_user(user_id):
             return jsonify({"status": "error", "message": "User not found."}), 404
-
-        delete_user(user_id)
         return jsonify({"status": "ok"})
 
     @app.post("/devices")
@@ -289,7 +453,7 @@ def create_app() -> Flask:
                 errors.append("Port must be a number.")
 
         if errors:
-            devices = [dict(row) for row in fetch_devices()]
+            devices = fetch_devices()
             return (
                 render_template(
                     "devices.html",
@@ -318,8 +482,8 @@ def create_app() -> Flask:
 
     @app.get("/api/devices")
     def api_devices():
-        devices = [dict(row) for row in fetch_devices()]
-        return jsonify({"devices": devices})
+        devices = fetch_devices()
+        return _orjson_response({"devices": devices})
 
     @app.get("/api/device/current")
     def api_current_device():
@@ -330,6 +494,8 @@ def create_app() -> Flask:
 
     @app.post("/api/device/test")
     def api_test_device():
+        from zk_sync import SyncError, test_connection
+
         payload = request.get_json(silent=True) or {}
         host = (payload.get("host") or payload.get("ip") or "").strip()
         port = payload.get("port")
@@ -358,6 +524,8 @@ def create_app() -> Flask:
 
     @app.post("/api/device/connect")
     def api_connect_device():
+        from zk_sync import SyncError, test_connection
+
         payload = request.get_json(silent=True) or {}
         host = (payload.get("host") or "").strip()
         port = payload.get("port")
@@ -392,12 +560,14 @@ def create_app() -> Flask:
             "force_udp": force_udp_flag,
         }
         session.modified = True
+        g.pop("device_config", None)
 
         return jsonify({"status": "ok", "config": session["device_config"]})
 
     @app.post("/api/device/disconnect")
     def api_disconnect_device():
         session.pop("device_config", None)
+        g.pop("device_config", None)
         return jsonify({"status": "ok"})
 
     return app
@@ -1,5 +1,8 @@
+import atexit
 import sqlite3
 import sys
+import threading
+import time
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Iterable, Optional
@@ -13,6 +16,25 @@ def _get_base_dir() -> Path:
 
 DB_PATH = _get_base_dir() / "attendance.db"
 
+# Stored in PRAGMA user_version; bump whenever init_db gains new DDL or migrations.
+SCHEMA_VERSION = 1
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+)
+
+RESULT_CACHE_TTL_SECONDS = 30.0
+
+# Punch timestamps are stored as naive local time in this format.
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+FETCH_USERS_QUERY = "SELECT user_id, name, department FROM users ORDER BY user_id"
+FETCH_DEVICES_QUERY = "SELECT id, name, mode, ip, port, created_at FROM devices ORDER BY id"
+
 CREATE_USERS_TABLE = """
 CREATE TABLE IF NOT EXISTS users (
     user_id INTEGER PRIMARY KEY,
@@ -29,11 +51,17 @@ CREATE TABLE IF NOT EXISTS attendance (
     timestamp TEXT NOT NULL,
     status INTEGER NOT NULL,
     synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (user_id),
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
     UNIQUE (user_id, timestamp, status)
 );
 """
 
+# (user_id, timestamp) lookups are already served by the UNIQUE autoindex on
+# attendance, and (user_id, date) by the one on makeup_hours.
+CREATE_ATTENDANCE_TIMESTAMP_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_attendance_timestamp ON attendance (timestamp);
+"""
+
 CREATE_MAKEUP_TABLE = """
 CREATE TABLE IF NOT EXISTS makeup_hours (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -42,10 +70,20 @@ CREATE TABLE IF NOT EXISTS makeup_hours (
     hours REAL NOT NULL,
     note TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
     UNIQUE (user_id, date)
 );
 """
 
+# Punches and make-up entries may predate their user row; register the IDs so
+# the cascading foreign keys can be enforced.
+REGISTER_REFERENCED_USERS = """
+INSERT OR IGNORE INTO users (user_id)
+SELECT user_id FROM attendance
+UNION
+SELECT user_id FROM makeup_hours;
+"""
+
 CREATE_DEVICES_TABLE = """
 CREATE TABLE IF NOT EXISTS devices (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -58,66 +96,211 @@ CREATE TABLE IF NOT EXISTS devices (
 """
 
 
+class UserExistsError(RuntimeError):
+    """Raised when creating a user whose ID is already registered."""
+
+
+_local = threading.local()
+
+
 def get_connection() -> sqlite3.Connection:
-    """Return a SQLite connection with Row factory enabled."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Return the calling thread's cached SQLite connection, opening it on first use.
+
+    The connection has the Row factory and tuned PRAGMAs enabled.
+    """
+    conn = getattr(_local, "connection", None)
+    if conn is None:
+        # Autocommit mode: write helpers open their own BEGIN IMMEDIATE transactions.
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        _local.connection = conn
     return conn
 
 
+@atexit.register
+def close_connection() -> None:
+    """Close the calling thread's cached connection, if any."""
+    conn = getattr(_local, "connection", None)
+    if conn is not None:
+        _local.connection = None
+        conn.close()
+
+
 def init_db() -> None:
-    """Create required tables if they do not exist."""
+    """Create required tables if they do not exist, unless the schema is current."""
     with get_connection() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # WAL is persistent in the database file; readers no longer block on writers.
+        conn.execute("PRAGMA journal_mode = WAL")
         cursor = conn.cursor()
         cursor.execute(CREATE_USERS_TABLE)
         cursor.execute(CREATE_ATTENDANCE_TABLE)
         cursor.execute(CREATE_MAKEUP_TABLE)
         cursor.execute(CREATE_DEVICES_TABLE)
+        _migrate_cascading_foreign_keys(conn)
+        cursor.execute(CREATE_ATTENDANCE_TIMESTAMP_INDEX)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
 
 
+def _migrate_cascading_foreign_keys(conn: sqlite3.Connection) -> None:
+    """Rebuild tables created before user_id foreign keys cascaded on delete.
+
+    SQLite cannot alter a foreign key in place, so each legacy table is renamed,
+    recreated from the current DDL and copied over.
+    """
+    table_ddl = {
+        "attendance": CREATE_ATTENDANCE_TABLE,
+        "makeup_hours": CREATE_MAKEUP_TABLE,
+    }
+    legacy_tables = [
+        table
+        for table in table_ddl
+        if not any(
+            fk["table"] == "users" and fk["on_delete"] == "CASCADE"
+            for fk in conn.execute(f"PRAGMA foreign_key_list({table})")
+        )
+    ]
+    if not legacy_tables:
+        return
+
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with get_cursor(commit=True) as cursor:
+            cursor.execute(REGISTER_REFERENCED_USERS)
+            for table in legacy_tables:
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+                cursor.execute(table_ddl[table])
+                cursor.execute(f"INSERT INTO {table} SELECT * FROM {table}_legacy")
+                cursor.execute(f"DROP TABLE {table}_legacy")
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    _invalidate_cached(FETCH_USERS_QUERY)
+
+
+_result_cache: dict[str, tuple[float, list[dict]]] = {}
+
+
+def _fetch_cached(query: str) -> list[dict]:
+    """Return the rows of a parameterless query, served from a short-lived cache."""
+    now = time.monotonic()
+    cached = _result_cache.get(query)
+    if cached is not None and now - cached[0] < RESULT_CACHE_TTL_SECONDS:
+        return list(cached[1])
+    with get_cursor() as cursor:
+        cursor.execute(query)
+        columns = [description[0] for description in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    _result_cache[query] = (now, rows)
+    return list(rows)
+
+
+def _invalidate_cached(query: str) -> None:
+    _result_cache.pop(query, None)
+
+
 @contextmanager
 def get_cursor(commit: bool = False):
-    """Context manager yielding a cursor that optionally commits on exit."""
+    """Context manager yielding a cursor, optionally inside a committed write transaction."""
     conn = get_connection()
     cursor = conn.cursor()
     try:
+        if commit:
+            cursor.execute("BEGIN IMMEDIATE")
         yield cursor
         if commit:
             conn.commit()
+    except BaseException:
+        # The connection outlives this block, so never leave a transaction open.
+        conn.rollback()
+        raise
     finally:
         cursor.close()
-        conn.close()
 
 
-def upsert_user(
+def bulk_upsert_users(rows: Iterable[tuple[int, Optional[str], Optional[str]]]) -> None:
+    """Upsert (user_id, name, department) rows in one transaction.
+
+    Existing names and departments are kept where the incoming value is None.
+    """
+    with get_cursor(commit=True) as cursor:
+        cursor.executemany(
+            """
+            INSERT INTO users (user_id, name, department)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id)
+            DO UPDATE SET
+                name = COALESCE(excluded.name, users.name),
+                department = COALESCE(excluded.department, users.department)
+            """,
+            rows,
+        )
+    _invalidate_cached(FETCH_USERS_QUERY)
+
+
+def insert_user(
     user_id: int,
     name: Optional[str] = None,
     department: Optional[str] = None,
-) -> None:
-    """Ensure the user exists and update metadata when provided."""
-    with get_cursor(commit=True) as cursor:
-        cursor.execute(
-            "INSERT OR IGNORE INTO users (user_id, name, department) VALUES (?, ?, ?)",
-            (user_id, name, department),
-        )
-        if name is not None or department is not None:
+) -> sqlite3.Row:
+    """Insert a new user and return the row. Raises UserExistsError on duplicates."""
+    try:
+        with get_cursor(commit=True) as cursor:
             cursor.execute(
                 """
-                UPDATE users
-                SET name = COALESCE(?, name),
-                    department = COALESCE(?, department)
-                WHERE user_id = ?
+                INSERT INTO users (user_id, name, department)
+                VALUES (?, ?, ?)
+                RETURNING user_id, name, department
                 """,
-                (name, department, user_id),
+                (user_id, name, department),
             )
+            user_row = cursor.fetchone()
+    except sqlite3.IntegrityError as exc:
+        raise UserExistsError(f"User {user_id} already exists.") from exc
+    _invalidate_cached(FETCH_USERS_QUERY)
+    return user_row
+
+
+def update_user_metadata(
+    user_id: int,
+    name: Optional[str] = None,
+    department: Optional[str] = None,
+) -> Optional[sqlite3.Row]:
+    """Update metadata for an existing user. Returns the row, or None if missing."""
+    with get_cursor(commit=True) as cursor:
+        cursor.execute(
+            """
+            UPDATE users
+            SET name = COALESCE(?, name),
+                department = COALESCE(?, department)
+            WHERE user_id = ?
+            RETURNING user_id, name, department
+            """,
+            (name, department, user_id),
+        )
+        user_row = cursor.fetchone()
+    if user_row is not None:
+        _invalidate_cached(FETCH_USERS_QUERY)
+    return user_row
 
 
 def bulk_insert_attendance(rows: Iterable[tuple[int, str, int]]) -> int:
-    """Insert raw attendance rows. Returns the number of new rows inserted."""
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        before = conn.total_changes
+    """Insert raw attendance rows. Returns the number of new rows inserted.
+
+    Punches can reference IDs the device did not report as users, so any missing
+    user is registered (without metadata) first. This is the only write path that
+    creates users implicitly; the foreign key rejects everything else.
+    """
+    rows = list(rows)
+    with get_cursor(commit=True) as cursor:
+        cursor.executemany(
+            "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+            [(user_id,) for user_id in {row[0] for row in rows}],
+        )
+        new_users = cursor.rowcount
         cursor.executemany(
             """
             INSERT OR IGNORE INTO attendance (user_id, timestamp, status)
@@ -125,8 +308,10 @@ def bulk_insert_attendance(rows: Iterable[tuple[int, str, int]]) -> int:
             """,
             rows,
         )
-        conn.commit()
-        return conn.total_changes - before
+        inserted = cursor.rowcount
+    if new_users:
+        _invalidate_cached(FETCH_USERS_QUERY)
+    return inserted
 
 
 def fetch_attendance_rows(
@@ -142,52 +327,46 @@ def fetch_attendance_rows(
     if user_id is not None:
         filters.append("user_id = ?")
         params.append(user_id)
+    # Compare the raw column against day boundaries so the timestamp indexes apply.
     if start_date is not None:
-        filters.append("date(timestamp) >= date(?)")
+        filters.append("timestamp >= date(?)")
         params.append(start_date)
     if end_date is not None:
-        filters.append("date(timestamp) <= date(?)")
+        filters.append("timestamp < date(?, '+1 day')")
         params.append(end_date)
 
     if filters:
         query += " WHERE " + " AND ".join(filters)
 
-    query += " ORDER BY timestamp ASC"
+    # Walk the (user_id, timestamp) UNIQUE index so rows arrive grouped per user.
+    query += " ORDER BY user_id ASC, timestamp ASC"
 
     with get_cursor() as cursor:
         cursor.execute(query, params)
         return cursor.fetchall()
 
 
-def fetch_users() -> list[sqlite3.Row]:
+def fetch_users() -> list[dict]:
     """Return all users."""
-    with get_cursor() as cursor:
-        cursor.execute("SELECT user_id, name, department FROM users ORDER BY user_id")
-        return cursor.fetchall()
+    return _fetch_cached(FETCH_USERS_QUERY)
 
 
-def get_user(user_id: int) -> Optional[sqlite3.Row]:
-    """Return a single user row or None."""
-    with get_cursor() as cursor:
-        cursor.execute("SELECT user_id, name, department FROM users WHERE user_id = ?", (user_id,))
-        return cursor.fetchone()
+def delete_user(user_id: int) -> int:
+    """Remove a user; attendance/make-up records follow via ON DELETE CASCADE.
 
-
-def delete_user(user_id: int) -> None:
-    """Remove a user and related attendance/make-up records."""
+    Returns the number of users deleted (0 when the user did not exist).
+    """
     with get_cursor(commit=True) as cursor:
-        cursor.execute("DELETE FROM attendance WHERE user_id = ?", (user_id,))
-        cursor.execute("DELETE FROM makeup_hours WHERE user_id = ?", (user_id,))
         cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        deleted = cursor.rowcount
+    if deleted:
+        _invalidate_cached(FETCH_USERS_QUERY)
+    return deleted
 
 
-def fetch_devices() -> list[sqlite3.Row]:
+def fetch_devices() -> list[dict]:
     """Return all configured devices."""
-    with get_cursor() as cursor:
-        cursor.execute(
-            "SELECT id, name, mode, ip, port, created_at FROM devices ORDER BY id"
-        )
-        return cursor.fetchall()
+    return _fetch_cached(FETCH_DEVICES_QUERY)
 
 
 def insert_device(
@@ -205,13 +384,16 @@ def insert_device(
             """,
             (name, mode, ip, port),
         )
-        return cursor.lastrowid
+        device_id = cursor.lastrowid
+    _invalidate_cached(FETCH_DEVICES_QUERY)
+    return device_id
 
 
 def delete_device(device_id: int) -> None:
     """Delete a device entry."""
     with get_cursor(commit=True) as cursor:
         cursor.execute("DELETE FROM devices WHERE id = ?", (device_id,))
+    _invalidate_cached(FETCH_DEVICES_QUERY)
 
 
 def set_makeup_hours(
@@ -219,21 +401,26 @@ def set_makeup_hours(
     date: str,
     hours: float,
     note: Optional[str] = None,
-) -> None:
-    """Create or update a make-up hours entry for the given user/date."""
+) -> bool:
+    """Create or update a make-up hours entry for the given user/date.
+
+    Returns False, without writing anything, when the user is not registered.
+    """
     with get_cursor(commit=True) as cursor:
         cursor.execute(
             """
             INSERT INTO makeup_hours (user_id, date, hours, note)
-            VALUES (?, date(?), ?, ?)
+            SELECT ?, date(?), ?, ?
+            WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)
             ON CONFLICT(user_id, date)
             DO UPDATE SET
                 hours = excluded.hours,
                 note = excluded.note,
                 created_at = CURRENT_TIMESTAMP
             """,
-            (user_id, date, hours, note),
+            (user_id, date, hours, note, user_id),
         )
+        return cursor.rowcount > 0
 
 
 def fetch_makeup_hours(
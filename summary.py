@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime, time
+from datetime import time
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 
-from db import fetch_attendance_rows, fetch_users, fetch_makeup_hours
+from db import TIMESTAMP_FORMAT, fetch_attendance_rows, fetch_users, fetch_makeup_hours
 
 WORK_START = time(8, 0)
 WORK_LUNCH_START = time(12, 0)
@@ -15,6 +16,48 @@ WORK_END = time(17, 0)
 LUNCH_BREAK_SECONDS = 3600
 
 
+def _time_offset(value: time) -> np.timedelta64:
+    return np.timedelta64(value.hour * 3600 + value.minute * 60 + value.second, "s")
+
+
+# Offsets from midnight, added to whole datetime64 day arrays.
+WORK_START_OFFSET = _time_offset(WORK_START)
+WORK_LUNCH_OFFSET = _time_offset(WORK_LUNCH_START)
+WORK_AFTERNOON_OFFSET = _time_offset(WORK_AFTERNOON_START)
+WORK_END_OFFSET = _time_offset(WORK_END)
+
+SUMMARY_COLUMNS = [
+    "user_id",
+    "name",
+    "department",
+    "date",
+    "check_in",
+    "check_out",
+    "working_hours",
+    "late_mins",
+    "early_leave_mins",
+    "makeup_hours",
+    "makeup_note",
+    "total_hours",
+    "missing_check_in",
+    "missing_check_out",
+    "is_day_off",
+    "weekday",
+    "weekday_label",
+    "is_weekend",
+    "worked_on_weekend",
+    "weekend_note",
+]
+
+METRIC_DTYPES = {
+    "check_in": "datetime64[ns]",
+    "check_out": "datetime64[ns]",
+    "working_hours": "float64",
+    "late_mins": "int64",
+    "early_leave_mins": "int64",
+}
+
+
 @dataclass
 class SummaryFilters:
     user_id: Optional[int] = None
@@ -32,102 +75,80 @@ def _load_dataframe(filters: SummaryFilters) -> pd.DataFrame:
         return pd.DataFrame(columns=["user_id", "timestamp", "status"])
 
     df = pd.DataFrame(rows, columns=["user_id", "timestamp", "status"])
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    df["date"] = df["timestamp"].dt.date
+    try:
+        # Punches are stored as "YYYY-MM-DD HH:MM:SS"; an explicit format skips inference.
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, cache=True)
+    except ValueError:
+        df["timestamp"] = pd.to_datetime(df["timestamp"], cache=True)
+    df["date"] = df["timestamp"].dt.normalize()
     return df
 
 
-def _calculate_metrics(user_id: int, date_value, group: pd.DataFrame) -> dict:
-    events = group.sort_values("timestamp")
-    timestamps = [row["timestamp"].to_pydatetime() for _, row in events.iterrows()]
-    if not timestamps:
-        return {
-            "user_id": int(user_id),
-            "date": date_value.isoformat(),
-            "check_in": None,
-            "check_out": None,
-            "working_hours": None,
-            "late_mins": 0,
-            "early_leave_mins": 0,
-        }
-
-    check_in_ts = min(timestamps) if timestamps else None
-    check_out_ts = max(timestamps) if timestamps else None
-
-    if check_in_ts and check_in_ts.time() >= WORK_LUNCH_START:
-        am_candidates = [ts for ts in timestamps if ts.time() < WORK_LUNCH_START]
-        check_in_ts = min(am_candidates) if am_candidates else None
-
-    if check_out_ts and check_out_ts.time() < WORK_LUNCH_START:
-        pm_candidates = [ts for ts in timestamps if ts.time() >= WORK_AFTERNOON_START]
-        check_out_ts = max(pm_candidates) if pm_candidates else None
-
-    if check_in_ts and check_out_ts and check_in_ts > check_out_ts:
-        check_in_ts, check_out_ts = check_out_ts, check_in_ts
-
-    work_hours = None
-    if check_in_ts and check_out_ts and check_out_ts > check_in_ts:
-        work_seconds = int((check_out_ts - check_in_ts).total_seconds())
-        if (
-            check_in_ts.time() <= WORK_LUNCH_START
-            and check_out_ts.time() >= WORK_AFTERNOON_START
-            and work_seconds > 6 * 3600
-        ):
-            work_seconds -= LUNCH_BREAK_SECONDS
-        work_hours = round(max(0, work_seconds) / 3600, 2)
-
-    work_start_dt = datetime.combine(date_value, WORK_START)
-    work_end_dt = datetime.combine(date_value, WORK_END)
-
-    late_minutes = (
-        max(0, int(round((check_in_ts - work_start_dt).total_seconds() / 60)))
-        if check_in_ts
-        else 0
+def _minutes_past(delta: np.ndarray) -> np.ndarray:
+    minutes = np.round(delta / np.timedelta64(60, "s"))
+    return np.nan_to_num(np.clip(minutes, 0, None)).astype(int)
+
+
+def _round_hours(hours: pd.Series) -> pd.Series:
+    rounded = hours.round(2)
+    # numpy rounds hours * 100 half-to-even, while the builtin round() looks at the
+    # exact binary value, so the two can disagree when the scaled value sits on .5.
+    scaled = hours * 100
+    ties = (scaled - np.floor(scaled) - 0.5).abs() < 1e-6
+    rounded[ties] = [round(value, 2) for value in hours[ties]]
+    return rounded
+
+
+def _aggregate_daily_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """Compute per (user_id, date) check-in/out, working hours and lateness in one pass."""
+    # Time of day as datetime64 arithmetic; .dt.time would box every value.
+    time_of_day = df["timestamp"] - df["timestamp"].dt.normalize()
+    am_mask = time_of_day < WORK_LUNCH_OFFSET
+    pm_mask = ~am_mask
+    # Rows arrive ordered by (user_id, timestamp), so groups already come out sorted.
+    # The earliest morning punch is the check-in and the latest punch from noon
+    # on is the check-out; a day with only one side leaves the other missing.
+    metrics = (
+        df.assign(
+            am_timestamp=df["timestamp"].where(am_mask),
+            pm_timestamp=df["timestamp"].where(pm_mask),
+        )
+        .groupby(["user_id", "date"], sort=False)
+        .agg(check_in=("am_timestamp", "min"), check_out=("pm_timestamp", "max"))
     )
-    early_leave_minutes = (
-        max(0, int(round((work_end_dt - check_out_ts).total_seconds() / 60)))
-        if check_out_ts
-        else 0
+
+    check_in = metrics["check_in"]
+    check_out = metrics["check_out"]
+    work_seconds = np.floor((check_out - check_in).dt.total_seconds())
+    lunch_taken = (
+        (check_out - check_out.dt.normalize() >= WORK_AFTERNOON_OFFSET)
+        & (work_seconds > 6 * 3600)
     )
+    work_seconds = work_seconds.where(~lunch_taken, work_seconds - LUNCH_BREAK_SECONDS)
+    metrics["working_hours"] = _round_hours(work_seconds.clip(lower=0) / 3600)
 
-    return {
-        "user_id": int(user_id),
-        "date": date_value.isoformat(),
-        "check_in": check_in_ts.isoformat() if check_in_ts else None,
-        "check_out": check_out_ts.isoformat() if check_out_ts else None,
-        "working_hours": work_hours,
-        "late_mins": late_minutes,
-        "early_leave_mins": early_leave_minutes,
-    }
+    day_start = metrics.index.get_level_values("date").to_numpy()
+    metrics["late_mins"] = _minutes_past(check_in.to_numpy() - (day_start + WORK_START_OFFSET))
+    metrics["early_leave_mins"] = _minutes_past((day_start + WORK_END_OFFSET) - check_out.to_numpy())
+    return metrics
 
 
-def get_daily_summary(
-    user_id: Optional[int] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-) -> list[dict]:
-    """Return computed daily attendance summary."""
-    filters = SummaryFilters(user_id=user_id, start_date=start_date, end_date=end_date)
+def _get_daily_summary_df(filters: SummaryFilters) -> pd.DataFrame:
+    """Compute the daily summary frame, one row per (user_id, date) in that order."""
     df = _load_dataframe(filters)
-    summary_map: dict[tuple[int, datetime.date], dict] = {}
 
     if not df.empty:
-        grouped = df.groupby(["user_id", "date"], sort=True)
-        for (user, date_value), group in grouped:
-            user_int = int(user)
-            metrics = _calculate_metrics(user_int, date_value, group)
-            metrics["late_mins"] = int(metrics["late_mins"])
-            metrics["early_leave_mins"] = int(metrics["early_leave_mins"])
-            if metrics["working_hours"] is not None:
-                metrics["working_hours"] = float(metrics["working_hours"])
-            metrics["date"] = date_value.isoformat()
-            summary_map[(user_int, date_value)] = metrics
-
-    users_rows = fetch_users()
-    users_lookup = {row["user_id"]: row for row in users_rows}
+        metrics = _aggregate_daily_metrics(df)
+    else:
+        metrics = pd.DataFrame(
+            {column: pd.Series(dtype=dtype) for column, dtype in METRIC_DTYPES.items()},
+            index=pd.MultiIndex.from_tuples([], names=["user_id", "date"]),
+        )
 
     if filters.start_date and filters.end_date:
-        date_index = pd.date_range(filters.start_date, filters.end_date, inclusive="both")
+        date_index = pd.date_range(
+            filters.start_date, filters.end_date, inclusive="both"
+        ).normalize()
     else:
         date_index = pd.DatetimeIndex([])
 
@@ -136,143 +157,82 @@ def get_daily_summary(
         start_date=filters.start_date,
         end_date=filters.end_date,
     )
-    for (mu_user, mu_date_str), payload in makeup_lookup.items():
-        mu_date = datetime.fromisoformat(mu_date_str).date()
-        if (mu_user, mu_date) not in summary_map:
-            summary_map[(mu_user, mu_date)] = {
-                "user_id": mu_user,
-                "date": mu_date.isoformat(),
-                "check_in": None,
-                "check_out": None,
-                "working_hours": None,
-                "late_mins": 0,
-                "early_leave_mins": 0,
-            }
-
-    if not summary_map and not makeup_lookup:
-        return []
-
-    active_users = {key[0] for key in summary_map.keys()}
-    if filters.user_id is not None:
-        active_users &= {int(filters.user_id)}
-
-    if date_index.size and active_users:
-        for user in active_users:
-            for ts in date_index:
-                date_obj = ts.date()
-                key = (user, date_obj)
-                if key not in summary_map:
-                    summary_map[key] = {
-                        "user_id": int(user),
-                        "date": date_obj.isoformat(),
-                        "check_in": None,
-                        "check_out": None,
-                        "working_hours": None,
-                        "late_mins": 0,
-                        "early_leave_mins": 0,
-                    }
-
-    summary_rows: list[dict] = []
-    for user in sorted(active_users):
-        user_dates = sorted([key[1] for key in summary_map.keys() if key[0] == user])
-        for date_obj in user_dates:
-            row = summary_map[(user, date_obj)]
-            row["late_mins"] = int(row.get("late_mins", 0))
-            row["early_leave_mins"] = int(row.get("early_leave_mins", 0))
-            if row.get("working_hours") is not None:
-                row["working_hours"] = float(row["working_hours"])
-
-            makeup_key = (row["user_id"], row["date"])
-            makeup_data = makeup_lookup.get(makeup_key, {})
-            row["makeup_hours"] = float(makeup_data.get("hours", 0.0))
-            row["makeup_note"] = makeup_data.get("note")
-            total_hours = (row["working_hours"] or 0.0) + row["makeup_hours"]
-            row["total_hours"] = round(total_hours, 2) if total_hours else None
-
-            check_in_ts = datetime.fromisoformat(row["check_in"]) if row["check_in"] else None
-            row["missing_check_in"] = check_in_ts is None
-            check_out_ts = datetime.fromisoformat(row["check_out"]) if row["check_out"] else None
-            row["missing_check_out"] = check_out_ts is None
-            row["is_day_off"] = row["missing_check_in"] and row["missing_check_out"]
-
-            date_obj = datetime.fromisoformat(row["date"]).date()
-            row["weekday"] = date_obj.weekday()
-            row["weekday_label"] = date_obj.strftime("%A")
-            row["is_weekend"] = row["weekday"] >= 5
-            row["worked_on_weekend"] = row["is_weekend"] and not row["is_day_off"]
-            if row["weekday"] == 5 and not row["is_day_off"]:
-                row["weekend_note"] = "Worked on Saturday"
-            else:
-                row["weekend_note"] = None
-
-            user_meta = users_lookup.get(row["user_id"])
-            row["name"] = user_meta["name"] if user_meta else None
-            row["department"] = user_meta["department"] if user_meta else None
-
-            summary_rows.append(row)
-
-    user_activity = {}
-    for row in summary_rows:
-        user_activity.setdefault(row["user_id"], False)
-        if not row["is_day_off"] or (row.get("makeup_hours") or 0) > 0:
-            user_activity[row["user_id"]] = True
-
-    filtered_rows = [
-        row for row in summary_rows if user_activity.get(row["user_id"], False)
-    ]
-
-    return filtered_rows
+    makeup_df = pd.DataFrame(
+        [
+            (mu_user, mu_date_str, payload["hours"], payload["note"])
+            for (mu_user, mu_date_str), payload in makeup_lookup.items()
+        ],
+        columns=["user_id", "date", "makeup_hours", "makeup_note"],
+    ).astype({"makeup_hours": "float64"})
+    makeup_df["date"] = pd.to_datetime(makeup_df["date"], format="%Y-%m-%d")
+    makeup_df = makeup_df.set_index(["user_id", "date"])
+    summary_index = metrics.index.union(makeup_df.index)
+    if summary_index.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    # Every active user gets a row for each day of a closed date range.
+    active_users = sorted(summary_index.unique(level="user_id"))
+    if date_index.size:
+        summary_index = summary_index.union(
+            pd.MultiIndex.from_product([active_users, date_index], names=["user_id", "date"])
+        )
+    summary_df = metrics.reindex(summary_index)
+    # Filling during the reindex keeps the minute counts int64 instead of
+    # round-tripping them through float NaN.
+    minute_columns = ["late_mins", "early_leave_mins"]
+    summary_df[minute_columns] = metrics[minute_columns].reindex(summary_index, fill_value=0)
+
+    makeup = makeup_df.reindex(summary_index)
+    summary_df["makeup_hours"] = makeup["makeup_hours"].fillna(0.0)
+    summary_df["makeup_note"] = makeup["makeup_note"].where(makeup["makeup_note"].notna(), None)
+    total_hours = _round_hours(summary_df["working_hours"].fillna(0.0) + summary_df["makeup_hours"])
+    summary_df["total_hours"] = total_hours.where(total_hours != 0)
+
+    summary_df["missing_check_in"] = summary_df["check_in"].isna()
+    summary_df["missing_check_out"] = summary_df["check_out"].isna()
+    summary_df["is_day_off"] = summary_df["missing_check_in"] & summary_df["missing_check_out"]
+    dates = pd.DatetimeIndex(summary_df.index.get_level_values("date"))
+    worked = ~summary_df["is_day_off"].to_numpy()
+    summary_df["weekday"] = dates.weekday
+    summary_df["weekday_label"] = pd.Categorical(dates.day_name())
+    summary_df["is_weekend"] = summary_df["weekday"] >= 5
+    summary_df["worked_on_weekend"] = summary_df["is_weekend"] & worked
+    summary_df["weekend_note"] = np.where(
+        (summary_df["weekday"] == 5) & worked, "Worked on Saturday", None
+    )
+
+    # Names and departments repeat on every row of a user, so keep them categorical.
+    users_df = pd.DataFrame(fetch_users(), columns=["user_id", "name", "department"]).astype(
+        {"name": "category", "department": "category"}
+    )
+    summary_df = summary_df.join(users_df.set_index("user_id"), on="user_id")
+
+    # Drop users whose every row is a day off without make-up hours.
+    has_activity = ~summary_df["is_day_off"] | (summary_df["makeup_hours"] > 0)
+    summary_df = summary_df[has_activity.groupby(level="user_id").transform("any")]
+
+    # The union/reindex above already yields (user_id, date) order.
+    output = summary_df.reset_index()
+    output["date"] = output["date"].dt.strftime("%Y-%m-%d")
+    for column in ("check_in", "check_out"):
+        formatted = output[column].map(pd.Timestamp.isoformat, na_action="ignore")
+        # An all-NaT column maps back to datetime64, so force object with None gaps.
+        output[column] = formatted.astype(object).where(output[column].notna(), None)
+    return output
+
+
+def get_daily_summary(
+    user_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> list[dict]:
+    """Return computed daily attendance summary."""
+    filters = SummaryFilters(user_id=user_id, start_date=start_date, end_date=end_date)
+    # Object dtype turns numpy scalars into Python values for the JSON/export callers.
+    output = _get_daily_summary_df(filters).astype(object)
+    return output.where(output.notna(), None).to_dict("records")
 
 
 def summary_dataframe(**kwargs) -> pd.DataFrame:
     """Convenience helper returning a pandas DataFrame version of the summary."""
-    records = get_daily_summary(**kwargs)
-    if not records:
-        return pd.DataFrame(
-            columns=[
-                "user_id",
-                "name",
-                "department",
-                "date",
-                "check_in",
-                "check_out",
-                "working_hours",
-                "late_mins",
-                "early_leave_mins",
-                "makeup_hours",
-                "makeup_note",
-                "total_hours",
-                "missing_check_in",
-                "missing_check_out",
-                "is_day_off",
-                "weekday",
-                "weekday_label",
-                "is_weekend",
-                "worked_on_weekend",
-                "weekend_note",
-            ]
-        )
-    df = pd.DataFrame(records)
-    desired_columns = [
-        "user_id",
-        "name",
-        "department",
-        "date",
-        "check_in",
-        "check_out",
-        "working_hours",
-        "late_mins",
-        "early_leave_mins",
-        "makeup_hours",
-        "makeup_note",
-        "total_hours",
-        "missing_check_in",
-        "missing_check_out",
-        "is_day_off",
-        "weekday",
-        "weekday_label",
-        "is_weekend",
-        "worked_on_weekend",
-        "weekend_note",
-    ]
-    return df[desired_columns]
+    return _get_daily_summary_df(SummaryFilters(**kwargs))[SUMMARY_COLUMNS]
@@ -6,12 +6,13 @@ from typing import Any, Dict, Iterable, Optional
 
 from zk import ZK
 
-from db import bulk_insert_attendance, init_db, upsert_user
+from db import bulk_insert_attendance, bulk_upsert_users, init_db
 
 
 DEVICE_IP = os.environ.get("ZK_DEVICE_IP", "192.168.0.201")
 DEVICE_PORT = int(os.environ.get("ZK_DEVICE_PORT", "4370"))
 DEVICE_TIMEOUT = int(os.environ.get("ZK_DEVICE_TIMEOUT", "5"))
+DEVICE_PASSWORD = int(os.environ.get("ZK_DEVICE_PASSWORD", "0"))
 FORCE_UDP = os.environ.get("ZK_DEVICE_FORCE_UDP", "false").lower() in {
     "1",
     "true",
@@ -33,18 +34,18 @@ class SyncError(RuntimeError):
 
 
 def _serialise_attendance(entries: Iterable[Any]) -> list[tuple[int, str, int]]:
-    serialised: list[tuple[int, str, int]] = []
-    for entry in entries:
-        if entry.timestamp is None:
-            continue
-        timestamp = entry.timestamp
-        if isinstance(timestamp, datetime):
-            timestamp_str = timestamp.isoformat(sep=" ", timespec="seconds")
-        else:
+    return [
+        (
+            int(entry.user_id),
+            entry.timestamp.isoformat(sep=" ", timespec="seconds")
+            if isinstance(entry.timestamp, datetime)
             # zk library sometimes returns naive strings already
-            timestamp_str = str(timestamp)
-        serialised.append((int(entry.user_id), timestamp_str, int(entry.status)))
-    return serialised
+            else str(entry.timestamp),
+            int(entry.status),
+        )
+        for entry in entries
+        if entry.timestamp is not None
+    ]
 
 
 def _sync_users(device_conn) -> None:
@@ -53,14 +54,16 @@ def _sync_users(device_conn) -> None:
     except Exception:
         # Skip silently if firmware does not support user extraction
         return
+    rows: list[tuple[int, Optional[str], Optional[str]]] = []
     for user in users:
-        name = getattr(user, "name", None) or None
-        dept = getattr(user, "department", None) or None
         try:
-            upsert_user(int(user.user_id), name=name, department=dept)
+            name = getattr(user, "name", None) or None
+            dept = getattr(user, "department", None) or None
+            rows.append((int(user.user_id), name, dept))
         except Exception:
             # Do not break sync on malformed metadata
             continue
+    bulk_upsert_users(rows)
 
 
 def _resolve_config(
@@ -73,7 +76,7 @@ def _resolve_config(
     return {
         "host": host or DEVICE_IP,
         "port": port or DEVICE_PORT,
-        "password": password if password is not None else int(os.environ.get("ZK_DEVICE_PASSWORD", "0")),
+        "password": password if password is not None else DEVICE_PASSWORD,
         "timeout": timeout or DEVICE_TIMEOUT,
         "force_udp": force_udp if force_udp is not None else FORCE_UDP,
     }